@@ -1,161 +1,420 @@
-from dotenv import load_dotenv
-load_dotenv()
-
 import asyncio
-import io
 import logging
+import time
+import traceback
 import uuid
-from datetime import datetime
+from dataclasses import dataclass
+from pathlib import Path
 from typing import Optional, List, Dict
 import chainlit as cl
-from openai import OpenAI
+import httpx
+from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
+from openai import AsyncOpenAI, AsyncAssistantEventHandler, DefaultAsyncHttpxClient
 import os
 
 # Import our custom modules
 from database import ChatDatabase
-from config import config, validate_file_upload, format_file_size, truncate_text
+from semantic_cache import SemanticCache, encode_embedding, decode_embedding
+from config import get_config, validate_file_upload, format_file_size, truncate_text
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-client = OpenAI(api_key=config.openai_api_key)
+# Load configuration and fail fast on missing values before any client is built
+config = get_config()
+config.ensure_ready()
+
+# Initialize OpenAI client, sharing one bounded keep-alive connection pool across all sessions
+client = AsyncOpenAI(
+    api_key=config.openai_api_key,
+    timeout=config.openai_timeout_seconds,
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=config.openai_max_connections,
+            max_keepalive_connections=config.openai_max_keepalive_connections
+        )
+    )
+)
+
+# How long a resolved vector store is trusted before re-checking it with OpenAI
+VECTOR_STORE_VERIFY_TTL = 600
+
+# Vector store file batch polling: start fast, back off while nothing changes
+BATCH_POLL_MIN_INTERVAL = 0.25
+BATCH_POLL_MAX_INTERVAL = 5.0
+BATCH_POLL_BACKOFF = 1.5
+BATCH_TERMINAL_STATUSES = frozenset({"completed", "failed", "cancelled"})
+
+# Short-lived cache of knowledge base reads, cleared whenever documents change
+_doc_cache = TTLCache(maxsize=32, ttl=30)
+
+# Size of the pieces a cached answer is streamed back in
+CACHED_RESPONSE_CHUNK_SIZE = 64
+
+# Streamed deltas are buffered until either limit is reached before being sent to the UI
+STREAM_FLUSH_CHARS = 32
+STREAM_FLUSH_INTERVAL = 0.05
+
+@dataclass(slots=True)
+class SessionCtx:
+    """Identifiers for a chat session, resolved once in on_chat_start."""
+    session_id: str
+    user_id: str
+    thread_id: str
+    assistant_id: str
+    vector_store_id: str
+    run_id: Optional[str] = None
+    thread_turns: int = 0  # user messages added to the OpenAI thread so far
+    titled: bool = False
+
+class _RunTrackingHandler(AsyncAssistantEventHandler):
+    """Stream handler that records the in-flight run on the session so it can be cancelled."""
+    
+    def __init__(self, ctx: SessionCtx):
+        super().__init__()
+        self._ctx = ctx
+    
+    async def on_event(self, event):
+        if event.event == "thread.run.created":
+            self._ctx.run_id = event.data.id
+
+async def _cancel_run(ctx: SessionCtx):
+    """Cancel the session's in-flight assistant run, if any, so it stops generating tokens."""
+    run_id, ctx.run_id = ctx.run_id, None
+    if run_id is None:
+        return
+    try:
+        await client.beta.threads.runs.cancel(run_id, thread_id=ctx.thread_id)
+        logger.info(f"Cancelled run {run_id}")
+    except Exception as e:
+        logger.warning(f"Error cancelling run {run_id}: {e}")
+
+def _get_session_user_id() -> Optional[str]:
+    """Get the current chat's user ID, if the session was initialized."""
+    ctx = cl.user_session.get("ctx")
+    return ctx.user_id if ctx else None
+
+def _get_file_name(file) -> str:
+    """Resolve the display name for an uploaded Chainlit file element."""
+    if getattr(file, 'content', None) is None and getattr(file, 'path', None):
+        return os.path.basename(file.path)
+    return getattr(file, 'name', 'unknown_file')
 
 class RAGAssistant:
     """OpenAI RAG Assistant with vector store management."""
     
     def __init__(self, organization_name: str):
         self.organization_name = organization_name
-        self.db = ChatDatabase(organization_name)
+        self.db = ChatDatabase(organization_name, db_path=config.database_path, wal=config.sqlite_wal)
         self.vector_store_id = None
         self.assistant_id = None
+        self._vector_store_verified_at = 0.0
+        self._assistant_vector_store_id = None
+        self._vector_store_lock = asyncio.Lock()
+        self._assistant_lock = asyncio.Lock()
+        self._warm_cache_task: Optional[asyncio.Task] = None
+        self.semantic_cache = SemanticCache(
+            path=config.semantic_cache_path,
+            threshold=config.semantic_cache_threshold,
+            max_entries=config.semantic_cache_max_entries
+        ) if config.enable_semantic_cache else None
     
-    async def get_or_create_vector_store(self) -> str:
-        """Get existing vector store or create a new one."""
-        # Check database for existing vector store
-        vector_store_id = self.db.get_vector_store()
-        
-        if vector_store_id:
-            try:
-                # Verify it still exists in OpenAI
-                vector_store = client.vector_stores.retrieve(vector_store_id)
-                logger.info(f"Using existing vector store: {vector_store_id}")
-                return vector_store_id
-            except Exception as e:
-                logger.warning(f"Vector store {vector_store_id} not found in OpenAI, creating new one: {e}")
-        
-        # Create new vector store
-        vector_store = client.vector_stores.create(
-            name=config.vector_store_name,
-            expires_after={
-                "anchor": "last_active_at",
-                "days": config.vector_store_expires_days
-            }
+    @cached(_doc_cache, key=lambda self: hashkey(self.organization_name, 'document_count'))
+    def get_document_count(self) -> int:
+        """Get the number of active documents, cached briefly."""
+        return self.db.get_document_count()
+    
+    @cached(_doc_cache, key=lambda self: hashkey(self.organization_name, 'documents'))
+    def list_documents(self) -> List[Dict]:
+        """List active documents, cached briefly."""
+        return self.db.list_documents()
+    
+    async def embed_query(self, text: str) -> List[float]:
+        """Embed a user query for semantic cache lookups."""
+        response = await client.embeddings.create(
+            model=config.openai_embedding_model,
+            input=text
+        )
+        return response.data[0].embedding
+    
+    def start_cache_warmup(self):
+        """Warm the semantic cache in the background, once per process."""
+        if self.semantic_cache is not None and self._warm_cache_task is None:
+            self._warm_cache_task = asyncio.create_task(self.warm_cache(config.semantic_cache_max_entries))
+            self._warm_cache_task.add_done_callback(self._log_warm_cache_failure)
+    
+    @staticmethod
+    def _log_warm_cache_failure(task: asyncio.Task):
+        """Log a warm-up that raised, since nothing awaits the background task."""
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error warming semantic cache: {task.exception()}")
+    
+    async def warm_cache(self, top_n: int = 1000) -> int:
+        """Seed an empty semantic cache with recent question/answer pairs from the database."""
+        if self.semantic_cache is None or len(self.semantic_cache):
+            return 0
+        
+        # The join over the message history runs in a worker thread, off the event loop
+        generation = self.semantic_cache.generation
+        exchanges = await asyncio.to_thread(self.db.get_recent_exchanges, top_n)
+        
+        # An upload or delete cleared the cache meanwhile, so these answers may be stale;
+        # a live answer added meanwhile means the cache no longer needs seeding
+        if self.semantic_cache.generation != generation or len(self.semantic_cache):
+            logger.info("Skipped semantic cache warm-up: the cache changed while loading")
+            return 0
+        
+        # Oldest first, so the newest exchanges survive eviction
+        self.semantic_cache.extend(
+            (exchange['vector_store_id'], exchange['query'],
+             decode_embedding(exchange['embedding']), exchange['response'])
+            for exchange in reversed(exchanges)
         )
         
-        # Save to database
-        self.db.create_vector_store(vector_store.id, config.vector_store_name)
-        logger.info(f"Created new vector store: {vector_store.id}")
-        
-        return vector_store.id
+        if exchanges:
+            self.semantic_cache.save()
+            logger.info(f"Warmed semantic cache with {len(exchanges)} past exchanges")
+        return len(exchanges)
+    
+    async def get_or_create_vector_store(self) -> str:
+        """Get existing vector store or create a new one."""
+        # Serialize resolution so concurrent sessions cannot create duplicate vector stores
+        async with self._vector_store_lock:
+            # Reuse the cached vector store until it is due for re-verification
+            if self.vector_store_id and time.monotonic() - self._vector_store_verified_at < VECTOR_STORE_VERIFY_TTL:
+                return self.vector_store_id
+            
+            # Check database for existing vector store
+            vector_store_id = self.vector_store_id or self.db.get_vector_store()
+            
+            if vector_store_id:
+                try:
+                    # Verify it still exists in OpenAI
+                    vector_store = await client.vector_stores.retrieve(vector_store_id)
+                    logger.info(f"Using existing vector store: {vector_store_id}")
+                    self.vector_store_id = vector_store_id
+                    self._vector_store_verified_at = time.monotonic()
+                    return vector_store_id
+                except Exception as e:
+                    logger.warning(f"Vector store {vector_store_id} not found in OpenAI, creating new one: {e}")
+            
+            # Create new vector store
+            vector_store = await client.vector_stores.create(
+                name=config.vector_store_name,
+                expires_after={
+                    "anchor": "last_active_at",
+                    "days": config.vector_store_expires_days
+                }
+            )
+            
+            # Save to database
+            self.db.create_vector_store(vector_store.id, config.vector_store_name)
+            logger.info(f"Created new vector store: {vector_store.id}")
+            
+            self.vector_store_id = vector_store.id
+            self._vector_store_verified_at = time.monotonic()
+            return vector_store.id
     
     async def create_assistant(self, vector_store_id: str) -> str:
-        """Create an OpenAI assistant with file search capability."""
-        assistant = client.beta.assistants.create(
-            name=f"{config.organization_display_name} RAG Assistant",
-            instructions=config.assistant_instructions,
-            model=config.openai_assistant_model,
-            tools=[{"type": "file_search"}],
-            tool_resources={
-                "file_search": {
-                    "vector_store_ids": [vector_store_id]
+        """Get the assistant for a vector store, creating it with file search capability if needed."""
+        # Serialize resolution so concurrent sessions cannot create duplicate assistants
+        async with self._assistant_lock:
+            if self.assistant_id and self._assistant_vector_store_id == vector_store_id:
+                return self.assistant_id
+            
+            name = f"{config.organization_display_name} RAG Assistant"
+            
+            # Reuse the assistant persisted by a previous process if it still exists
+            assistant_id = self.db.get_assistant(vector_store_id, config.openai_assistant_model)
+            if assistant_id:
+                try:
+                    assistant = await client.beta.assistants.retrieve(assistant_id)
+                except Exception as e:
+                    logger.warning(f"Assistant {assistant_id} not found in OpenAI, creating new one: {e}")
+                else:
+                    # Apply display name or instruction changes made since it was created
+                    if assistant.name != name or assistant.instructions != config.assistant_instructions:
+                        try:
+                            await client.beta.assistants.update(
+                                assistant_id,
+                                name=name,
+                                instructions=config.assistant_instructions
+                            )
+                            logger.info(f"Updated assistant {assistant_id} to the current configuration")
+                        except Exception as e:
+                            logger.warning(f"Error updating assistant {assistant_id}: {e}")
+                    
+                    logger.info(f"Using existing assistant: {assistant_id}")
+                    self.assistant_id = assistant_id
+                    self._assistant_vector_store_id = vector_store_id
+                    return assistant_id
+            
+            assistant = await client.beta.assistants.create(
+                name=name,
+                instructions=config.assistant_instructions,
+                model=config.openai_assistant_model,
+                tools=[{"type": "file_search"}],
+                tool_resources={
+                    "file_search": {
+                        "vector_store_ids": [vector_store_id]
+                    }
                 }
-            }
-        )
-        
-        logger.info(f"Created assistant: {assistant.id}")
-        return assistant.id
+            )
+            
+            # Save to database
+            self.db.set_assistant(assistant.id, vector_store_id, config.openai_assistant_model)
+            logger.info(f"Created assistant: {assistant.id}")
+            
+            self.assistant_id = assistant.id
+            self._assistant_vector_store_id = vector_store_id
+            return assistant.id
     
     async def upload_documents(self, files: List[cl.File], user_id: str = None) -> Dict:
         """Upload documents to the vector store."""
         if not files:
             return {"success": False, "message": "No files provided"}
         
-        vector_store_id = await self.get_or_create_vector_store()
-        
         uploaded_files = []
         errors = []
+        pending = []
         
+        # Validate every file before anything is sent to OpenAI
         for file in files:
+            file_name = _get_file_name(file)
             try:
                 # Handle Chainlit File elements that have .path instead of .content
                 file_content = None
-                file_name = getattr(file, 'name', 'unknown_file')
+                file_path = None
                 
                 if hasattr(file, 'content') and file.content is not None:
                     # File has direct content
                     file_content = file.content
+                    file_size = len(file_content)
                 elif hasattr(file, 'path') and file.path:
-                    # File has path, read content from disk
-                    import os
-                    file_name = os.path.basename(file.path)
-                    with open(file.path, 'rb') as f:
-                        file_content = f.read()
+                    # File has path, it is streamed from disk at upload time
+                    file_path = file.path
+                    # Element.size is Chainlit's display size ("small"/"medium"/"large"), not bytes
+                    file_size = os.path.getsize(file_path)
                 else:
                     errors.append(f"{file_name}: No file content or path available")
                     continue
                 
                 # Check if file content is valid
-                if file_content is None or len(file_content) == 0:
+                if file_size == 0:
                     errors.append(f"{file_name}: File content is empty or corrupted")
                     continue
                     
                 # Validate file
-                is_valid, validation_message = validate_file_upload(file_name, len(file_content))
+                is_valid, validation_message = validate_file_upload(file_name, file_size)
                 if not is_valid:
                     errors.append(f"{file_name}: {validation_message}")
                     continue
                 
-                # Create file stream for OpenAI
-                file_stream = io.BytesIO(file_content)
-                file_stream.name = file_name
-                
-                # Upload to OpenAI
-                openai_file = client.files.create(
-                    file=file_stream,
-                    purpose="assistants"
-                )
-                
-                # Add to vector store
-                client.vector_stores.files.create_and_poll(
+                pending.append((file_name, file_content, file_path, file_size))
+            except Exception as e:
+                errors.append(f"{file_name}: {str(e)}")
+                logger.error(f"Error reading {file_name}: {e}")
+        
+        # Phase 1: upload the raw files concurrently, bounded to stay under OpenAI rate limits
+        semaphore = asyncio.Semaphore(config.max_parallel_uploads)
+        
+        async def _upload_one(file_name: str, file_content: Optional[bytes], file_path: Optional[str]):
+            async with semaphore:
+                if file_content is None:
+                    # Read in a worker thread to keep disk I/O off the event loop; reading inside
+                    # the semaphore caps memory at max_parallel_uploads files
+                    file_content = await asyncio.to_thread(Path(file_path).read_bytes)
+                return await client.files.create(file=(file_name, file_content), purpose="assistants")
+        
+        # Resolve the vector store while the raw files upload; only phase 2 needs it
+        vector_store_task = asyncio.create_task(self.get_or_create_vector_store())
+        
+        results = await asyncio.gather(
+            *[_upload_one(name, content, path) for name, content, path, _ in pending],
+            return_exceptions=True
+        )
+        
+        vector_store_id = await vector_store_task
+        
+        created = []
+        for (file_name, _, _, file_size), result in zip(pending, results):
+            if isinstance(result, BaseException):
+                errors.append(f"{file_name}: {str(result)}")
+                logger.error(f"Error uploading {file_name}: {result}")
+            else:
+                created.append((file_name, file_size, result.id))
+        
+        if not created:
+            return {
+                "success": False,
+                "uploaded_files": uploaded_files,
+                "errors": errors,
+                "total_files": len(files),
+                "successful_uploads": 0
+            }
+        
+        try:
+            # Phase 2: attach all uploaded files to the vector store as one batch
+            batch = await client.vector_stores.file_batches.create(
+                vector_store_id=vector_store_id,
+                file_ids=[file_id for _, _, file_id in created]
+            )
+            batch = await self._wait_for_file_batch(vector_store_id, batch)
+            
+            completed_ids = {file_id for _, _, file_id in created}
+            file_failures = {}
+            if batch.file_counts.completed != len(created):
+                # Some files did not index: collect each file's own status and error
+                completed_ids = set()
+                async for f in client.vector_stores.file_batches.list_files(
                     vector_store_id=vector_store_id,
-                    file_id=openai_file.id
-                )
+                    batch_id=batch.id
+                ):
+                    if f.status == "completed":
+                        completed_ids.add(f.id)
+                    elif f.last_error is not None:
+                        file_failures[f.id] = f"indexing {f.status}: {f.last_error.message}"
+                    else:
+                        file_failures[f.id] = f"indexing {f.status}"
+            
+            # Phase 3: record the indexed documents
+            db_rows = []
+            for file_name, file_size, file_id in created:
+                if file_id not in completed_ids:
+                    errors.append(f"{file_name}: Vector store {file_failures.get(file_id, 'indexing failed')}")
+                    continue
                 
-                # Save to database
-                self.db.add_document(
-                    filename=file_name,
-                    openai_file_id=openai_file.id,
-                    vector_store_id=vector_store_id,
-                    file_size=len(file_content),
-                    uploaded_by=user_id
-                )
+                db_rows.append({
+                    'filename': file_name,
+                    'openai_file_id': file_id,
+                    'vector_store_id': vector_store_id,
+                    'file_size': file_size,
+                    'uploaded_by': user_id
+                })
                 
                 uploaded_files.append({
                     'filename': file_name,
-                    'id': openai_file.id,
-                    'size': len(file_content)
+                    'id': file_id,
+                    'size': file_size
                 })
                 
-                logger.info(f"Uploaded document: {file_name} ({openai_file.id})")
-                
-            except Exception as e:
-                error_msg = f"{file_name}: {str(e)}"
-                errors.append(error_msg)
-                logger.error(f"Error uploading {file_name}: {e}")
-                # Add debug info about the error
-                import traceback
-                logger.error(f"Full traceback for {file_name}:\n{traceback.format_exc()}")
+                logger.info(f"Uploaded document: {file_name} ({file_id})")
+            
+            self.db.add_documents_bulk(db_rows)
+            
+            # Cached answers may not reflect the new documents
+            if uploaded_files:
+                _doc_cache.clear()
+                if self.semantic_cache is not None:
+                    self.semantic_cache.clear()
+        
+        except Exception as e:
+            for file_name, _, _ in created:
+                errors.append(f"{file_name}: {str(e)}")
+            logger.error(f"Error adding files to vector store {vector_store_id}: {e}")
+            # Add debug info about the error
+            logger.error(f"Full traceback for batch upload:\n{traceback.format_exc()}")
         
         return {
             "success": len(uploaded_files) > 0,
@@ -165,15 +424,41 @@ class RAGAssistant:
             "successful_uploads": len(uploaded_files)
         }
     
+    async def _wait_for_file_batch(self, vector_store_id: str, batch):
+        """Poll a vector store file batch until it finishes, backing off while nothing changes."""
+        interval = BATCH_POLL_MIN_INTERVAL
+        in_progress = batch.file_counts.in_progress
+        
+        while batch.status not in BATCH_TERMINAL_STATUSES:
+            await asyncio.sleep(interval)
+            batch = await client.vector_stores.file_batches.retrieve(
+                batch_id=batch.id,
+                vector_store_id=vector_store_id
+            )
+            
+            # Poll quickly again while files are finishing, slow down while they are not
+            if batch.file_counts.in_progress != in_progress:
+                in_progress = batch.file_counts.in_progress
+                interval = BATCH_POLL_MIN_INTERVAL
+            else:
+                interval = min(interval * BATCH_POLL_BACKOFF, BATCH_POLL_MAX_INTERVAL)
+        
+        return batch
+    
     async def delete_document(self, file_id: str) -> bool:
         """Delete a document from OpenAI and mark as deleted in database."""
         try:
             # Delete from OpenAI
-            client.files.delete(file_id)
+            await client.files.delete(file_id)
             
             # Mark as deleted in database
             self.db.delete_document(file_id)
             
+            # Cached answers may cite the removed document
+            _doc_cache.clear()
+            if self.semantic_cache is not None:
+                self.semantic_cache.clear()
+            
             logger.info(f"Deleted document: {file_id}")
             return True
         except Exception as e:
@@ -186,6 +471,9 @@ rag_assistant = RAGAssistant(config.organization_name)
 @cl.on_chat_start
 async def start():
     """Initialize chat session."""
+    # Lookups simply miss until the first warm-up finishes
+    rag_assistant.start_cache_warmup()
+    
     try:
         # Get user information
         user = cl.user_session.get("user")
@@ -208,12 +496,14 @@ async def start():
         # Create chat session
         session_id = str(uuid.uuid4())
         
-        # Get or create vector store and assistant
-        vector_store_id = await rag_assistant.get_or_create_vector_store()
-        assistant_id = await rag_assistant.create_assistant(vector_store_id)
+        # Resolve the vector store and create the OpenAI thread concurrently
+        vector_store_id, thread = await asyncio.gather(
+            rag_assistant.get_or_create_vector_store(),
+            client.beta.threads.create()
+        )
         
-        # Create OpenAI thread
-        thread = client.beta.threads.create()
+        # Get or create the assistant (cached after the first session)
+        assistant_id = await rag_assistant.create_assistant(vector_store_id)
         
         # Save session to database
         rag_assistant.db.create_chat_session(
@@ -225,14 +515,16 @@ async def start():
         )
         
         # Store in session
-        cl.user_session.set("session_id", session_id)
-        cl.user_session.set("user_id", user_id)
-        cl.user_session.set("thread_id", thread.id)
-        cl.user_session.set("assistant_id", assistant_id)
-        cl.user_session.set("vector_store_id", vector_store_id)
+        cl.user_session.set("ctx", SessionCtx(
+            session_id=session_id,
+            user_id=user_id,
+            thread_id=thread.id,
+            assistant_id=assistant_id,
+            vector_store_id=vector_store_id
+        ))
         
         # Get current document count
-        doc_count = rag_assistant.db.get_document_count()
+        doc_count = rag_assistant.get_document_count()
         
         welcome_message = f"Welcome to **{config.organization_display_name}** RAG Assistant! 👋\n\n"
         welcome_message += f"📚 **Knowledge Base**: {doc_count} document(s) available\n\n"
@@ -257,6 +549,54 @@ async def start():
         logger.error(f"Error in chat start: {e}")
         await cl.Message(content="❌ Error initializing chat. Please refresh and try again.").send()
 
+@cl.on_stop
+async def stop():
+    """Cancel the assistant run when the user stops generation."""
+    ctx = cl.user_session.get("ctx")
+    if ctx is not None:
+        await _cancel_run(ctx)
+
+@cl.on_chat_end
+async def end():
+    """Cancel any assistant run still streaming when the client disconnects."""
+    ctx = cl.user_session.get("ctx")
+    if ctx is not None:
+        await _cancel_run(ctx)
+
+# Static command responses, built once at import
+_HELP_MD = """## 🆘 Help & Commands
+
+**Slash Commands:**
+• `/kb` or `/kb list` - View all documents in knowledge base
+• `/kb search <query>` - Search through your documents  
+• `/docs` - Show document statistics
+• `/help` - Show this help message
+
+**File Upload:**
+• Drag & drop files directly into the chat
+• Supported: PDF, DOCX, TXT, MD, HTML, JSON, CSV, XML
+• Max file size: 20MB per file
+
+**Chat Features:**
+• Ask questions about your uploaded documents
+• Follow-up questions maintain conversation context
+• Streaming responses for real-time interaction
+
+**Examples:**
+• "What are the main topics in my documents?"
+• "Summarize the key points from the uploaded PDFs"
+• "Find information about [specific topic]"
+
+💡 *Just start typing your question - I'll automatically search your knowledge base!*"""
+
+_KB_HEADER = "## 📚 Knowledge Base\n\n"
+_KB_EMPTY_MD = _KB_HEADER + "**No documents found.**\n\nUpload documents by dragging them into the chat!"
+_KB_LIST_HEADER = _KB_HEADER + "**Your Documents:**\n\n"
+_KB_COMMANDS_TIP = "💡 *Commands: `/kb list`, `/docs`, `/help`*"
+
+_DOCS_HEADER = "## 📊 Document Statistics\n\n"
+_DOCS_FOOTER = "\n💡 *Use `/kb list` to see all documents*"
+
 async def handle_slash_commands(message: cl.Message):
     """Handle knowledge base commands and regular messages."""
     content = message.content.strip()
@@ -277,23 +617,22 @@ async def handle_slash_commands(message: cl.Message):
 async def handle_knowledge_base_command(command: str):
     """Handle knowledge base slash commands."""
     try:
-        user_id = cl.user_session.get("user_id")
-        
         if command == '/kb' or command == '/kb list':
             # List all documents
-            documents = rag_assistant.db.list_documents()
+            documents = rag_assistant.list_documents()
             
             if not documents:
-                content = "## 📚 Knowledge Base\n\n**No documents found.**\n\nUpload documents by dragging them into the chat!"
+                content = _KB_EMPTY_MD
             else:
-                content = "## 📚 Knowledge Base\n\n**Your Documents:**\n\n"
+                parts: List[str] = [_KB_LIST_HEADER]
                 for i, doc in enumerate(documents, 1):
                     upload_date = doc.get('upload_date', 'Unknown')
                     file_size = format_file_size(doc.get('file_size', 0))
-                    content += f"{i}. **{doc['filename']}** ({file_size})\n   📅 Uploaded: {upload_date}\n\n"
+                    parts.append(f"{i}. **{doc['filename']}** ({file_size})\n   📅 Uploaded: {upload_date}\n\n")
                 
-                content += f"**Total: {len(documents)} documents**\n\n"
-                content += "💡 *Commands: `/kb list`, `/docs`, `/help`*"
+                parts.append(f"**Total: {len(documents)} documents**\n\n")
+                parts.append(_KB_COMMANDS_TIP)
+                content = "".join(parts)
             
             await cl.Message(content=content).send()
             
@@ -301,8 +640,8 @@ async def handle_knowledge_base_command(command: str):
             search_term = command[11:].strip()
             if search_term:
                 await cl.Message(content=f"🔍 Searching for: **{search_term}**\n\nLet me find relevant information in your documents...").send()
-                # This will be handled by the regular message processing
-                await handle_message_content(cl.Message(content=f"Find information about: {search_term}"))
+                # Query the assistant directly; the synthetic prompt is not saved as a user turn
+                await _run_assistant_query(f"Find information about: {search_term}", save_as_user=False)
             else:
                 await cl.Message(content="❌ Please provide a search term: `/kb search your query`").send()
         else:
@@ -315,26 +654,24 @@ async def handle_knowledge_base_command(command: str):
 async def handle_documents_command():
     """Show document statistics and management options."""
     try:
-        user_id = cl.user_session.get("user_id")
-        
         # Get document statistics
-        total_docs = rag_assistant.db.get_document_count()
-        user_docs = rag_assistant.db.list_documents()
+        total_docs = rag_assistant.get_document_count()
+        recent_docs = rag_assistant.db.list_recent_documents(3)
         
-        content = "## 📊 Document Statistics\n\n"
+        content = _DOCS_HEADER
         content += f"📚 **Total Documents**: {total_docs}\n"
-        content += f"👤 **Your Documents**: {len(user_docs)}\n\n"
+        content += f"👤 **Your Documents**: {total_docs}\n\n"
         
         # Recent uploads
-        if user_docs:
+        if recent_docs:
             content += "**Recent Uploads:**\n"
-            for doc in user_docs[:3]:  # Show last 3
+            for doc in recent_docs:  # Show last 3
                 content += f"• {doc['filename']}\n"
             
-            if len(user_docs) > 3:
-                content += f"• ... and {len(user_docs) - 3} more\n"
+            if total_docs > 3:
+                content += f"• ... and {total_docs - 3} more\n"
         
-        content += "\n💡 *Use `/kb list` to see all documents*"
+        content += _DOCS_FOOTER
         
         await cl.Message(content=content).send()
         
@@ -344,32 +681,7 @@ async def handle_documents_command():
 
 async def handle_help_command():
     """Show help information."""
-    content = """## 🆘 Help & Commands
-
-**Slash Commands:**
-• `/kb` or `/kb list` - View all documents in knowledge base
-• `/kb search <query>` - Search through your documents  
-• `/docs` - Show document statistics
-• `/help` - Show this help message
-
-**File Upload:**
-• Drag & drop files directly into the chat
-• Supported: PDF, DOCX, TXT, MD, HTML, JSON, CSV, XML
-• Max file size: 20MB per file
-
-**Chat Features:**
-• Ask questions about your uploaded documents
-• Follow-up questions maintain conversation context
-• Streaming responses for real-time interaction
-
-**Examples:**
-• "What are the main topics in my documents?"
-• "Summarize the key points from the uploaded PDFs"
-• "Find information about [specific topic]"
-
-💡 *Just start typing your question - I'll automatically search your knowledge base!*"""
-    
-    await cl.Message(content=content).send()
+    await cl.Message(content=_HELP_MD).send()
 
 # Message handler will be defined later to combine with file upload handling
 
@@ -388,7 +700,7 @@ async def upload_files_handler(message: cl.Message):
     
     # Handle file uploads
     try:
-        user_id = cl.user_session.get("user_id")
+        user_id = _get_session_user_id()
         
         # Show upload progress
         progress_msg = cl.Message(content="🔄 Uploading documents...")
@@ -438,22 +750,21 @@ async def upload_files_handler(message: cl.Message):
 async def handle_knowledge_base_action(action):
     """Handle knowledge base page navigation."""
     try:
-        user_id = cl.user_session.get("user_id")
-        
         # Get all documents for this user/organization
-        documents = rag_assistant.db.list_documents()
+        documents = rag_assistant.list_documents()
         
         if not documents:
             content = "## 📁 Knowledge Base\n\n**No documents found.**\n\nUpload documents by dragging them into the chat or using the file upload feature."
         else:
-            content = "## 📁 Knowledge Base\n\n**Your Documents:**\n\n"
+            parts: List[str] = ["## 📁 Knowledge Base\n\n**Your Documents:**\n\n"]
             for doc in documents:
                 upload_date = doc.get('upload_date', 'Unknown')
                 file_size = format_file_size(doc.get('file_size', 0))
-                content += f"• **{doc['filename']}** ({file_size}) - Uploaded: {upload_date}\n"
+                parts.append(f"• **{doc['filename']}** ({file_size}) - Uploaded: {upload_date}\n")
             
-            content += f"\n**Total: {len(documents)} documents**\n\n"
-            content += "💡 *Tip: Ask me questions about these documents and I'll search through them for relevant information.*"
+            parts.append(f"\n**Total: {len(documents)} documents**\n\n")
+            parts.append("💡 *Tip: Ask me questions about these documents and I'll search through them for relevant information.*")
+            content = "".join(parts)
         
         await cl.Message(content=content).send()
         
@@ -465,7 +776,7 @@ async def handle_knowledge_base_action(action):
 async def handle_chat_history_action(action):
     """Handle chat history page navigation."""
     try:
-        user_id = cl.user_session.get("user_id")
+        user_id = _get_session_user_id()
         
         # Get recent chat sessions
         sessions = rag_assistant.db.get_user_sessions(user_id, limit=10) if user_id else []
@@ -488,55 +799,155 @@ async def handle_chat_history_action(action):
         logger.error(f"Error in chat history action: {e}")
         await cl.Message(content="❌ Error loading chat history.").send()
 
+async def _stream_coalesced(deltas, response_msg: cl.Message) -> str:
+    """Stream text deltas into a message, coalescing them into fewer websocket frames.
+    
+    Buffered text is flushed once it reaches STREAM_FLUSH_CHARS or has waited
+    STREAM_FLUSH_INTERVAL, including while the model is idle between deltas.
+    Returns the full streamed text.
+    """
+    response_parts = []
+    buffer = []
+    buffered_chars = 0
+    last_flush = time.monotonic()
+    
+    async def flush():
+        nonlocal buffered_chars, last_flush
+        # A slow stream usually flushes a single delta; skip the join for it
+        await response_msg.stream_token(buffer[0] if len(buffer) == 1 else "".join(buffer))
+        buffer.clear()
+        buffered_chars = 0
+        last_flush = time.monotonic()
+    
+    iterator = deltas.__aiter__()
+    next_delta = asyncio.ensure_future(anext(iterator))
+    try:
+        while True:
+            timeout = None
+            if buffer:
+                timeout = max(0.0, STREAM_FLUSH_INTERVAL - (time.monotonic() - last_flush))
+            
+            # Wait without cancelling the pending read, so an idle stream still gets flushed
+            done, _ = await asyncio.wait({next_delta}, timeout=timeout)
+            if not done:
+                await flush()
+                continue
+            
+            try:
+                text = next_delta.result()
+            except StopAsyncIteration:
+                break
+            next_delta = asyncio.ensure_future(anext(iterator))
+            
+            response_parts.append(text)
+            buffer.append(text)
+            buffered_chars += len(text)
+            if buffered_chars >= STREAM_FLUSH_CHARS or time.monotonic() - last_flush > STREAM_FLUSH_INTERVAL:
+                await flush()
+    finally:
+        # Cancel the pending read and wait for it, so it is neither left pending
+        # nor leaves an unretrieved exception behind
+        next_delta.cancel()
+        await asyncio.gather(next_delta, return_exceptions=True)
+    
+    if buffer:
+        await flush()
+    
+    return "".join(response_parts)
+
 async def handle_message_content(message: cl.Message):
     """Handle regular text messages."""
+    await _run_assistant_query(message.content, save_as_user=True)
+
+async def _run_assistant_query(query: str, save_as_user: bool = True):
+    """Send a query to the assistant and stream the answer into a new message.
+    
+    With save_as_user=False the query is not recorded as a user turn in the chat history.
+    """
     try:
         # Get session data
-        session_id = cl.user_session.get("session_id")
-        user_id = cl.user_session.get("user_id")
-        thread_id = cl.user_session.get("thread_id")
-        assistant_id = cl.user_session.get("assistant_id")
+        ctx: Optional[SessionCtx] = cl.user_session.get("ctx")
         
-        if not all([session_id, thread_id, assistant_id]):
+        if ctx is None or not all([ctx.session_id, ctx.thread_id, ctx.assistant_id]):
             await cl.Message("❌ Session error. Please refresh the page.").send()
             return
         
-        # Save user message to database
-        rag_assistant.db.save_message(session_id, "user", message.content)
+        session_id = ctx.session_id
+        thread_id = ctx.thread_id
+        assistant_id = ctx.assistant_id
+        vector_store_id = ctx.vector_store_id
+        
+        # Look for a previous answer to a near-identical question. The cache is shared by every
+        # user, so only a thread's opening question (which has no prior context) may use it
+        query_embedding = None
+        cached_response = None
+        if rag_assistant.semantic_cache is not None and ctx.thread_turns == 0:
+            try:
+                query_embedding = await rag_assistant.embed_query(query)
+                cached_response = rag_assistant.semantic_cache.lookup(vector_store_id, query_embedding)
+            except Exception as e:
+                logger.warning(f"Semantic cache lookup failed: {e}")
+        
+        # Save user message to database, with its embedding so the cache can be rebuilt on restart
+        if save_as_user:
+            rag_assistant.db.save_message(
+                session_id, "user", query,
+                embedding=encode_embedding(query_embedding) if query_embedding is not None else None
+            )
         
         # Add message to OpenAI thread
-        client.beta.threads.messages.create(
+        await client.beta.threads.messages.create(
             thread_id=thread_id,
             role="user",
-            content=message.content
+            content=query
         )
+        ctx.thread_turns += 1
         
         # Create response message
         response_msg = cl.Message(content="")
         await response_msg.send()
         
-        # Stream the response
-        response_content = ""
-        with client.beta.threads.runs.stream(
-            thread_id=thread_id,
-            assistant_id=assistant_id
-        ) as stream:
-            for text in stream.text_deltas:
-                response_content += text
-                await response_msg.stream_token(text)
+        if cached_response is not None:
+            # Replay the cached answer and keep the thread in sync for follow-up questions
+            response_content = cached_response
+            for i in range(0, len(cached_response), CACHED_RESPONSE_CHUNK_SIZE):
+                await response_msg.stream_token(cached_response[i:i + CACHED_RESPONSE_CHUNK_SIZE])
+            
+            await client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="assistant",
+                content=cached_response
+            )
+        else:
+            # Stream the response
+            try:
+                async with client.beta.threads.runs.stream(
+                    thread_id=thread_id,
+                    assistant_id=assistant_id,
+                    event_handler=_RunTrackingHandler(ctx)
+                ) as stream:
+                    response_content = await _stream_coalesced(stream.text_deltas, response_msg)
+                    
+                    # Drain any trailing events so the HTTP connection is released as soon as the run ends
+                    await stream.until_done()
+            except asyncio.CancelledError:
+                # Stopped by the user: make sure OpenAI stops generating as well
+                await asyncio.shield(_cancel_run(ctx))
+                raise
+            ctx.run_id = None
+            
+            if query_embedding is not None and response_content:
+                rag_assistant.semantic_cache.add(vector_store_id, query, query_embedding, response_content)
         
         await response_msg.update()
         
-        # Save assistant response to database
+        # Save assistant response to database (also bumps the session's last activity)
         rag_assistant.db.save_message(session_id, "assistant", response_content)
         
-        # Update session activity
-        rag_assistant.db.update_session_activity(session_id)
-        
-        # Auto-generate chat title if this is the first exchange
-        message_count = rag_assistant.db.get_message_count(session_id)
-        if message_count == 2:  # First user message + first assistant response
-            title = truncate_text(message.content, config.chat_title_length)
+        # Title the chat after its first user message; /kb searches (save_as_user=False) don't count
+        if save_as_user and not ctx.titled:
+            ctx.titled = True
+            title = truncate_text(query, config.chat_title_length)
             rag_assistant.db.update_chat_title(session_id, title)
         
     except Exception as e:
@@ -548,22 +959,26 @@ async def handle_message_content(message: cl.Message):
 async def view_documents():
     """Display uploaded documents."""
     try:
-        docs = rag_assistant.db.list_documents()
+        docs = rag_assistant.list_documents()
         
         if not docs:
             await cl.Message(content="📄 No documents uploaded yet.").send()
             return
         
         # Create formatted document list
-        doc_content = f"📚 **Knowledge Base ({len(docs)} documents):**\n\n"
+        parts: List[str] = [f"📚 **Knowledge Base ({len(docs)} documents):**\n\n"]
         
         for i, doc in enumerate(docs, 1):
             size_str = format_file_size(doc['size'])
-            doc_content += f"{i}. **{doc['filename']}**\n"
-            doc_content += f"   • Size: {size_str}\n"
-            doc_content += f"   • Uploaded: {doc['upload_date']}\n"
-            doc_content += f"   • By: {doc['uploaded_by']}\n"
-            doc_content += f"   • ID: `{doc['id'][:16]}...`\n\n"
+            parts.append(
+                f"{i}. **{doc['filename']}**\n"
+                f"   • Size: {size_str}\n"
+                f"   • Uploaded: {doc['upload_date']}\n"
+                f"   • By: {doc['uploaded_by']}\n"
+                f"   • ID: `{doc['id'][:16]}...`\n\n"
+            )
+        
+        doc_content = "".join(parts)
         
         # Add delete actions
         delete_actions = []
@@ -589,20 +1004,24 @@ async def view_documents():
 async def view_chat_history():
     """Display chat history."""
     try:
-        user_id = cl.user_session.get("user_id")
+        user_id = _get_session_user_id()
         sessions = rag_assistant.db.list_chat_sessions(user_id, limit=20)
         
         if not sessions:
             await cl.Message(content="💬 No previous chats found.").send()
             return
         
-        chat_content = f"💬 **Recent Conversations ({len(sessions)}):**\n\n"
+        parts: List[str] = [f"💬 **Recent Conversations ({len(sessions)}):**\n\n"]
         
         for i, session in enumerate(sessions, 1):
-            chat_content += f"{i}. **{session['title']}**\n"
-            chat_content += f"   • Started: {session['created_at']}\n"
-            chat_content += f"   • Messages: {session['message_count']}\n"
-            chat_content += f"   • Last active: {session['last_activity']}\n\n"
+            parts.append(
+                f"{i}. **{session['title']}**\n"
+                f"   • Started: {session['created_at']}\n"
+                f"   • Messages: {session['message_count']}\n"
+                f"   • Last active: {session['last_activity']}\n\n"
+            )
+        
+        chat_content = "".join(parts)
         
         await cl.Message(content=chat_content).send()
         
@@ -639,8 +1058,7 @@ async def delete_document_action(action):
         file_id = action.value
         
         # Find document name for confirmation
-        docs = rag_assistant.db.list_documents()
-        doc_name = next((d['filename'] for d in docs if d['id'] == file_id), "Unknown")
+        doc_name = (rag_assistant.db.get_document(file_id) or {}).get('filename', "Unknown")
         
         # Ask for confirmation
         confirm_actions = [
@@ -664,8 +1082,7 @@ async def confirm_delete_document(action):
         file_id = action.value
         
         # Get document name before deletion
-        docs = rag_assistant.db.list_documents()
-        doc_name = next((d['filename'] for d in docs if d['id'] == file_id), "Unknown")
+        doc_name = (rag_assistant.db.get_document(file_id) or {}).get('filename', "Unknown")
         
         # Delete the document
         success = await rag_assistant.delete_document(file_id)
@@ -684,6 +1101,13 @@ async def cancel_delete_document(action):
     """Cancel document deletion."""
     await cl.Message(content="❌ Document deletion cancelled.").send()
 
+# ISO 8601 timestamp format used by the health check
+HEALTH_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+def _health_timestamp() -> str:
+    """Format the current local time for health check responses."""
+    return time.strftime(HEALTH_TIMESTAMP_FORMAT)
+
 # Health check endpoint for Cloud Run
 @cl.server.app.get("/health")
 async def health_check():
@@ -695,11 +1119,12 @@ async def health_check():
             "organization": config.organization_name,
             "database": "connected",
             "openai": "configured" if config.openai_api_key else "missing",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _health_timestamp()
         }
         
         # Test database connection
         try:
+            # get_stats is cached briefly by the database layer, so frequent probes stay cheap
             stats = rag_assistant.db.get_stats()
             health_status["database"] = "operational"
             health_status["documents"] = stats["documents"]
@@ -713,7 +1138,7 @@ async def health_check():
         return {
             "status": "unhealthy",
             "error": str(e),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _health_timestamp()
         }
 
 # Log configuration on startup
@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from typing import Optional
 import logging
 
@@ -29,21 +30,40 @@ class Config:
         
         # Database Configuration
         self.data_directory: str = os.getenv("DATA_DIRECTORY", "/data")
+        self.database_path: str = f"{self.data_directory}/{self.organization_name}.db"
+        # WAL is faster but unsafe on network mounts (the Cloud Run /data volume is gcsfuse)
+        self.sqlite_wal: bool = os.getenv("SQLITE_WAL", "false").lower() == "true"
         
         # OpenAI Model Configuration
         self.openai_model: str = os.getenv("OPENAI_MODEL", "gpt-4-turbo-preview")
         self.openai_assistant_model: str = os.getenv("OPENAI_ASSISTANT_MODEL", "gpt-4-turbo-preview")
         
+        # OpenAI Client Configuration
+        self.openai_timeout_seconds: float = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
+        # Each streaming answer holds a connection, so stay at or above Cloud Run's default
+        # concurrency of 80 requests per instance
+        self.openai_max_connections: int = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+        self.openai_max_keepalive_connections: int = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        
         # Vector Store Configuration
         self.vector_store_name: str = f"{self.organization_name}-knowledge-base"
         self.vector_store_expires_days: int = int(os.getenv("VECTOR_STORE_EXPIRES_DAYS", "365"))
         
+        # Semantic Cache Configuration
+        self.openai_embedding_model: str = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+        self.semantic_cache_threshold: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+        self.semantic_cache_max_entries: int = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+        
         # File Upload Configuration
         self.max_file_size_mb: int = int(os.getenv("MAX_FILE_SIZE_MB", "20"))
-        self.allowed_file_types: list = os.getenv(
-            "ALLOWED_FILE_TYPES", 
-            "pdf,txt,md,docx,doc,rtf,html,json,csv,xml"
-        ).split(",")
+        self.allowed_file_types: frozenset[str] = frozenset(
+            ext.strip().lower() for ext in os.getenv(
+                "ALLOWED_FILE_TYPES", 
+                "pdf,txt,md,docx,doc,rtf,html,json,csv,xml"
+            ).split(",")
+        )
+        self.max_file_size_bytes: int = self.max_file_size_mb << 20
+        self.max_parallel_uploads: int = int(os.getenv("MAX_PARALLEL_UPLOADS", "4"))
         
         # Chat Configuration
         self.max_chat_history: int = int(os.getenv("MAX_CHAT_HISTORY", "50"))
@@ -57,16 +77,25 @@ class Config:
         self.enable_document_management: bool = os.getenv("ENABLE_DOCUMENT_MANAGEMENT", "true").lower() == "true"
         self.enable_chat_history: bool = os.getenv("ENABLE_CHAT_HISTORY", "true").lower() == "true"
         self.enable_user_management: bool = os.getenv("ENABLE_USER_MANAGEMENT", "false").lower() == "true"
+        self.enable_semantic_cache: bool = os.getenv("ENABLE_SEMANTIC_CACHE", "false").lower() == "true"
         
         # Development/Debug Configuration
         self.debug_mode: bool = os.getenv("DEBUG", "false").lower() == "true"
         self.log_level: str = os.getenv("LOG_LEVEL", "INFO")
         
+        self._ready = False
+    
+    def ensure_ready(self):
+        """Apply the log level and validate critical configuration (runs once)."""
+        if self._ready:
+            return
+        
         # Set log level
         logging.getLogger().setLevel(getattr(logging, self.log_level.upper()))
         
         # Validate critical configuration
         self._validate_config()
+        self._ready = True
     
     def _validate_config(self):
         """Validate critical configuration values."""
@@ -84,6 +113,18 @@ class Config:
         if self.max_file_size_mb > 512:  # OpenAI limit
             errors.append("MAX_FILE_SIZE_MB cannot exceed 512MB (OpenAI limit)")
         
+        if self.max_parallel_uploads <= 0:
+            errors.append("MAX_PARALLEL_UPLOADS must be positive")
+        
+        if self.openai_timeout_seconds <= 0:
+            errors.append("OPENAI_TIMEOUT_SECONDS must be positive")
+        
+        if self.openai_max_connections <= 0:
+            errors.append("OPENAI_MAX_CONNECTIONS must be positive")
+        
+        if not 0 <= self.openai_max_keepalive_connections <= self.openai_max_connections:
+            errors.append("OPENAI_MAX_KEEPALIVE_CONNECTIONS must be between 0 and OPENAI_MAX_CONNECTIONS")
+        
         if errors:
             raise ValueError(f"Configuration errors: {', '.join(errors)}")
     
@@ -93,9 +134,9 @@ class Config:
         return bool(self.openai_api_key and self.organization_name)
     
     @property
-    def database_path(self) -> str:
-        """Get the SQLite database path for this organization."""
-        return f"{self.data_directory}/{self.organization_name}.db"
+    def semantic_cache_path(self) -> str:
+        """Get the on-disk location of the semantic response cache."""
+        return f"{self.data_directory}/{self.organization_name}-semantic-cache.npz"
     
     @property
     def assistant_instructions(self) -> str:
@@ -120,11 +161,12 @@ Current knowledge base contains documents that users have uploaded. Use the file
             "openai_model": self.openai_model,
             "vector_store_name": self.vector_store_name,
             "max_file_size_mb": self.max_file_size_mb,
-            "allowed_file_types": self.allowed_file_types,
+            "allowed_file_types": sorted(self.allowed_file_types),
             "features": {
                 "document_management": self.enable_document_management,
                 "chat_history": self.enable_chat_history,
                 "user_management": self.enable_user_management,
+                "semantic_cache": self.enable_semantic_cache,
                 "auth_required": self.require_auth
             },
             "debug_mode": self.debug_mode,
@@ -138,40 +180,46 @@ Current knowledge base contains documents that users have uploaded. Use the file
             if not key.startswith('_') and key != 'openai_api_key'  # Don't expose API key
         }
 
-# Global config instance
-config = Config()
+@lru_cache(maxsize=None)
+def load_environment():
+    """Load variables from a .env file into the environment, once per process."""
+    from dotenv import load_dotenv
+    load_dotenv()
 
+@lru_cache(maxsize=None)
 def get_config() -> Config:
-    """Get the global configuration instance."""
-    return config
+    """Get the global configuration instance, reading the environment on first use."""
+    load_environment()
+    return Config()
 
 def validate_file_upload(filename: str, file_size: int) -> tuple[bool, str]:
     """Validate file upload against configuration."""
+    config = get_config()
+    
     # Check file size
-    max_size_bytes = config.max_file_size_mb * 1024 * 1024
-    if file_size > max_size_bytes:
+    if file_size > config.max_file_size_bytes:
         return False, f"File size ({file_size / 1024 / 1024:.1f}MB) exceeds maximum allowed size ({config.max_file_size_mb}MB)"
     
     # Check file type
-    file_extension = filename.lower().split('.')[-1] if '.' in filename else ''
+    _, dot, file_extension = filename.rpartition('.')
+    file_extension = file_extension.lower() if dot else ''
     if file_extension not in config.allowed_file_types:
-        return False, f"File type '{file_extension}' not allowed. Supported types: {', '.join(config.allowed_file_types)}"
+        return False, f"File type '{file_extension}' not allowed. Supported types: {', '.join(sorted(config.allowed_file_types))}"
     
     return True, "File is valid"
 
+# (unit, divisor) indexed by how many whole powers of 1024 a size spans
+_SIZE_UNITS = (("B", 1), ("KB", 1 << 10), ("MB", 1 << 20), ("GB", 1 << 30))
+
 def format_file_size(size_bytes: int) -> str:
     """Format file size in human readable format."""
     if size_bytes < 1024:
         return f"{size_bytes} B"
-    elif size_bytes < 1024**2:
-        return f"{size_bytes / 1024:.1f} KB"
-    elif size_bytes < 1024**3:
-        return f"{size_bytes / (1024**2):.1f} MB"
-    else:
-        return f"{size_bytes / (1024**3):.1f} GB"
+    unit, divisor = _SIZE_UNITS[min((int(size_bytes).bit_length() - 1) // 10, 3)]
+    return f"{size_bytes / divisor:.1f} {unit}"
 
 def truncate_text(text: str, max_length: int = 100) -> str:
     """Truncate text to specified length with ellipsis."""
     if len(text) <= max_length:
         return text
-    return text[:max_length-3] + "..."
\ No newline at end of file
+    return f"{text[:max_length-1]}…"
\ No newline at end of file
@@ -1,28 +1,363 @@
+import atexit
 import sqlite3
-import json
+import queue
+import threading
+import copy
+from contextlib import contextmanager
+from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional, Tuple
 import os
 import uuid
 import logging
 
+import orjson
+from cachetools import LRUCache, TTLCache
+
 logger = logging.getLogger(__name__)
 
+# Columns aliased as "name [json]" are decoded while SQLite fetches the row
+sqlite3.register_converter('json', orjson.loads)
+
+def _dump_json(value) -> Optional[str]:
+    """Serialize a metadata/preferences dict for a TEXT column, or None when empty."""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode() if value else None
+
+# Read-only connections kept open per database; writes share one connection
+READ_POOL_SIZE = 4
+
+# Recently read chat histories kept per database, keyed by (session_id, limit)
+HISTORY_CACHE_SIZE = 128
+
+# Seconds get_stats results are reused; the counts tolerate a little staleness
+STATS_CACHE_TTL = 5
+
+# Bump whenever _create_schema changes, so existing databases are migrated on open
+SCHEMA_VERSION = 4
+
+# Timestamp columns stored as integer Unix epoch seconds, rebuilt from older ISO TEXT tables
+_EPOCH_COLUMNS = {
+    'documents': ('upload_date',),
+    'chat_sessions': ('created_at', 'last_activity'),
+    'messages': ('timestamp',),
+}
+
+# Prepared statements kept per connection (sqlite3 default is 128)
+STATEMENT_CACHE_SIZE = 256
+
+# Statements run per chat or per message, shared so every call hits the connection's statement cache
+_SQL_SAVE_MESSAGE = '''
+    INSERT INTO messages (session_id, role, content, openai_message_id, metadata, embedding)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+_SQL_UPDATE_ACTIVITY = '''
+    UPDATE chat_sessions 
+    SET last_activity = CAST(strftime('%s', 'now') AS INTEGER) 
+    WHERE session_id = ?
+'''
+
+_SQL_RECORD_MESSAGES = '''
+    UPDATE chat_sessions 
+    SET last_activity = CAST(strftime('%s', 'now') AS INTEGER), message_count = message_count + ? 
+    WHERE session_id = ?
+'''
+
+_SQL_BUMP_COUNTER = 'UPDATE counters SET value = value + ? WHERE name = ?'
+
+# Messages up to this id predate the current knowledge base; set whenever documents change
+_SQL_BUMP_CACHE_WATERMARK = '''
+    UPDATE counters 
+    SET value = (SELECT COALESCE(MAX(id), 0) FROM messages) 
+    WHERE name = 'cache_watermark'
+'''
+
+_SQL_BUMP_MESSAGES_HOURLY = '''
+    INSERT INTO messages_hourly (hour, count)
+    VALUES (CAST(strftime('%s', 'now') AS INTEGER) / 3600, ?)
+    ON CONFLICT(hour) DO UPDATE SET count = count + excluded.count
+'''
+
+_SQL_CHAT_HISTORY = '''
+    SELECT role, content, datetime(timestamp, 'unixepoch') AS timestamp, openai_message_id, 
+           COALESCE(metadata, '{}') AS "metadata [json]"
+    FROM messages 
+    WHERE session_id = ?
+    ORDER BY messages.timestamp ASC
+    LIMIT ?
+'''
+
+_SQL_MESSAGE_COUNT = 'SELECT COUNT(*) FROM messages WHERE session_id = ?'
+
+_SQL_ACTIVE_VECTOR_STORE = '''
+    SELECT vector_store_id FROM vector_stores 
+    WHERE status = 'active' 
+    ORDER BY created_at DESC 
+    LIMIT 1
+'''
+
+_SQL_ACTIVE_ASSISTANT = '''
+    SELECT assistant_id FROM assistants 
+    WHERE vector_store_id = ? AND model = ? AND status = 'active' 
+    ORDER BY created_at DESC 
+    LIMIT 1
+'''
+
+_SQL_RECENT_DOCUMENTS = '''
+    SELECT filename, openai_file_id AS id, datetime(upload_date, 'unixepoch') AS upload_date, file_size AS size,
+           COALESCE(NULLIF(uploaded_by, ''), 'Unknown') AS uploaded_by
+    FROM documents 
+    WHERE status = 'active'
+    ORDER BY documents.upload_date DESC, rowid DESC
+    LIMIT ?
+'''
+
+_SQL_DOCUMENT_COUNT = "SELECT COUNT(*) FROM documents WHERE status = 'active'"
+
+_SQL_SESSION_EXISTS = 'SELECT 1 FROM chat_sessions WHERE session_id = ?'
+
+_SQL_UPSERT_SESSION = '''
+    INSERT INTO chat_sessions 
+    (session_id, user_id, thread_id, assistant_id, vector_store_id, title)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(session_id) DO UPDATE SET 
+        user_id = excluded.user_id, thread_id = excluded.thread_id, 
+        assistant_id = excluded.assistant_id, vector_store_id = excluded.vector_store_id, 
+        title = excluded.title, last_activity = excluded.last_activity
+'''
+
+_SQL_GET_SESSION = '''
+    SELECT session_id, user_id, thread_id, assistant_id, vector_store_id, 
+           datetime(created_at, 'unixepoch') AS created_at, 
+           datetime(last_activity, 'unixepoch') AS last_activity, title, status
+    FROM chat_sessions 
+    WHERE session_id = ?
+'''
+
+_SQL_USER_SESSIONS = '''
+    SELECT session_id, title, datetime(created_at, 'unixepoch') AS created_at, 
+           datetime(last_activity, 'unixepoch') AS last_activity, message_count
+    FROM chat_sessions
+    WHERE user_id = ? AND status = 'active'
+    ORDER BY chat_sessions.last_activity DESC
+    LIMIT ?
+'''
+
+_SQL_ACTIVE_SESSIONS = '''
+    SELECT session_id, title, datetime(created_at, 'unixepoch') AS created_at, 
+           datetime(last_activity, 'unixepoch') AS last_activity, message_count
+    FROM chat_sessions
+    WHERE status = 'active'
+    ORDER BY chat_sessions.last_activity DESC
+    LIMIT ?
+'''
+
+_SQL_UPDATE_TITLE = '''
+    UPDATE chat_sessions 
+    SET title = ? 
+    WHERE session_id = ?
+'''
+
+_SQL_USER_EXISTS = 'SELECT 1 FROM users WHERE user_id = ?'
+
+_SQL_UPSERT_USER = '''
+    INSERT INTO users (user_id, email, name, preferences, last_login)
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(user_id) DO UPDATE SET 
+        email = excluded.email, name = excluded.name, 
+        preferences = excluded.preferences, last_login = excluded.last_login
+'''
+
+_SQL_STATS = '''
+    SELECT
+        (SELECT value FROM counters WHERE name = 'documents') AS documents,
+        (SELECT value FROM counters WHERE name = 'sessions') AS sessions,
+        (SELECT value FROM counters WHERE name = 'messages') AS messages,
+        (SELECT value FROM counters WHERE name = 'users') AS users,
+        (SELECT COALESCE(SUM(count), 0) FROM messages_hourly 
+         WHERE hour > CAST(strftime('%s', 'now') AS INTEGER) / 3600 - 24) AS messages_24h
+'''
+
+# Data directories already created by this process
+_DATA_DIRS_READY = set()
+
+# One open ChatDatabase per (organization, database path), shared by every caller in the process
+_INSTANCES: Dict[Tuple[str, str], 'ChatDatabase'] = {}
+_INSTANCES_LOCK = threading.Lock()
+
+def close_all():
+    """Checkpoint and close every shared ChatDatabase, so nothing is left unflushed on shutdown."""
+    with _INSTANCES_LOCK:
+        instances = list(_INSTANCES.values())
+    for instance in instances:
+        instance.close()
+
+# The connections stay open for the process lifetime, so release them on interpreter exit
+atexit.register(close_all)
+
 class ChatDatabase:
     """SQLite database for storing chat history, documents, and user data per organization."""
     
-    def __init__(self, organization_name: str):
-        self.organization_name = organization_name
-        # Ensure data directory exists
-        os.makedirs("/data", exist_ok=True)
-        self.db_path = f"/data/{organization_name}.db"
-        self._init_db()
+    def __new__(cls, organization_name: str, db_path: Optional[str] = None, wal: bool = False):
+        # An in-memory database is private to whoever opened it, so it is never shared
+        if db_path == ':memory:':
+            instance = super().__new__(cls)
+            instance._initialized = False
+            instance._instance_key = None
+            return instance
+        
+        # Reuse the already initialized instance, and its connections, for this database
+        key = (organization_name, db_path or f"/data/{organization_name}.db")
+        with _INSTANCES_LOCK:
+            instance = _INSTANCES.get(key)
+            if instance is None:
+                instance = super().__new__(cls)
+                instance._initialized = False
+                instance._instance_key = key
+                _INSTANCES[key] = instance
+            return instance
+    
+    def __init__(self, organization_name: str, db_path: Optional[str] = None, wal: bool = False):
+        """Open the database at db_path (default /data/<organization>.db; ':memory:' is allowed).
+        
+        wal switches to WAL with synchronous=NORMAL, which is only safe on a local disk. The
+        default rollback journal with synchronous=FULL suits network mounts such as gcsfuse.
+        """
+        with _INSTANCES_LOCK:
+            if self._initialized:
+                return
+            
+            self.organization_name = organization_name
+            if db_path is None:
+                db_path = f"/data/{organization_name}.db"
+            if db_path != ':memory:':
+                # Ensure data directory exists
+                data_dir = os.path.dirname(os.path.abspath(db_path))
+                if data_dir not in _DATA_DIRS_READY:
+                    os.makedirs(data_dir, exist_ok=True)
+                    _DATA_DIRS_READY.add(data_dir)
+            self.db_path = db_path
+            self.wal = wal
+            
+            # Long-lived connections: one serialized writer, a pool of concurrent readers
+            self._write_lock = threading.Lock()
+            self._write_conn = self._connect()
+            self._init_db()
+            
+            # An in-memory database exists only on its own connection, so reads share the writer
+            self._read_pool: Optional[queue.Queue] = None
+            if self.db_path != ':memory:':
+                self._read_pool = queue.Queue()
+                for _ in range(READ_POOL_SIZE):
+                    self._read_pool.put(self._connect(read_only=True))
+            
+            # Read caches, invalidated by the write methods
+            self._cache_lock = threading.Lock()
+            self._history_cache = LRUCache(maxsize=HISTORY_CACHE_SIZE)
+            self._stats_cache = TTLCache(maxsize=1, ttl=STATS_CACHE_TTL)
+            # Bumped after every committed write; reads that overlapped one are not cached
+            self._cache_generation = 0
+            self._initialized = True
+    
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """Open a connection with the per-connection performance pragmas applied."""
+        if read_only:
+            conn = sqlite3.connect(f"{Path(self.db_path).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False,
+                                   cached_statements=STATEMENT_CACHE_SIZE, detect_types=sqlite3.PARSE_COLNAMES)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                   cached_statements=STATEMENT_CACHE_SIZE, detect_types=sqlite3.PARSE_COLNAMES)
+        conn.row_factory = sqlite3.Row
+        # NORMAL skips the fsync per commit, which is only durable with WAL on a local disk
+        conn.execute(f"PRAGMA synchronous = {'NORMAL' if self.wal else 'FULL'}")
+        conn.execute('PRAGMA temp_store = MEMORY')
+        if self.wal:
+            # Memory-mapped I/O only on a local disk; FUSE mounts do not keep mappings coherent
+            conn.execute('PRAGMA mmap_size = 268435456')  # 256 MB
+        conn.execute('PRAGMA cache_size = -65536')  # 64 MB
+        conn.execute('PRAGMA busy_timeout = 5000')
+        return conn
+    
+    @contextmanager
+    def _read(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read-only connection from the pool."""
+        if self._read_pool is None:
+            with self._write_lock:
+                yield self._write_conn
+            return
+        
+        conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+    
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """Hold the write connection for one transaction, committed on success and rolled back on error."""
+        # The connection's own context manager does the commit/rollback
+        with self._write_lock:
+            with self._write_conn:
+                yield self._write_conn
+            with self._cache_lock:
+                self._cache_generation += 1
+    
+    def _invalidate_history(self, session_id: str):
+        """Drop cached chat histories for a session after its messages change."""
+        with self._cache_lock:
+            for key in [key for key in self._history_cache if key[0] == session_id]:
+                del self._history_cache[key]
+    
+    def close(self):
+        """Close every pooled connection; the next ChatDatabase() for this organization reopens them."""
+        with _INSTANCES_LOCK:
+            if not self._initialized:
+                return
+            if _INSTANCES.get(self._instance_key) is self:
+                del _INSTANCES[self._instance_key]
+            self._initialized = False
+        while self._read_pool is not None and not self._read_pool.empty():
+            self._read_pool.get_nowait().close()
+        with self._write_lock:
+            if self.wal:
+                # Fold the -wal file back into the database so the file alone is complete
+                try:
+                    self._write_conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                except sqlite3.Error as e:
+                    logger.error(f"Error checkpointing database: {e}")
+            self._write_conn.close()
     
     def _init_db(self):
         """Initialize all database tables."""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._write_conn
         cursor = conn.cursor()
         
+        # The mode persists in the file, so set it on every open: WAL needs shared memory and
+        # working locks, which network filesystems like the gcsfuse /data volume do not provide
+        cursor.execute(f"PRAGMA journal_mode = {'WAL' if self.wal else 'DELETE'}")
+        
+        # Schema DDL and migrations only run when the file is behind SCHEMA_VERSION
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] != SCHEMA_VERSION:
+            self._create_schema(cursor)
+            cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.commit()
+            
+            # Refresh planner statistics, sampling a bounded number of rows per index
+            cursor.execute('PRAGMA analysis_limit = 1000')
+            cursor.execute('ANALYZE')
+        
+        # Buckets older than a day are never read again
+        cursor.execute('''
+            DELETE FROM messages_hourly 
+            WHERE hour <= CAST(strftime('%s', 'now') AS INTEGER) / 3600 - 24
+        ''')
+        
+        conn.commit()
+        logger.info(f"Database initialized for organization: {self.organization_name}")
+    
+    def _create_schema(self, cursor: sqlite3.Cursor):
+        """Create all tables and indexes, migrating databases made by older versions."""
         # Documents table - tracks uploaded documents
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS documents (
@@ -30,7 +365,7 @@ class ChatDatabase:
                 filename TEXT NOT NULL,
                 openai_file_id TEXT NOT NULL,
                 vector_store_id TEXT NOT NULL,
-                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                upload_date INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)), -- Unix epoch seconds
                 file_size INTEGER,
                 status TEXT DEFAULT 'active',
                 uploaded_by TEXT
@@ -45,10 +380,11 @@ class ChatDatabase:
                 thread_id TEXT,
                 assistant_id TEXT,
                 vector_store_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)), -- Unix epoch seconds
+                last_activity INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
                 title TEXT DEFAULT 'New Chat',
-                status TEXT DEFAULT 'active'
+                status TEXT DEFAULT 'active',
+                message_count INTEGER DEFAULT 0 -- kept in step with messages by save_message
             )
         ''')
         
@@ -59,13 +395,31 @@ class ChatDatabase:
                 session_id TEXT,
                 role TEXT NOT NULL, -- 'user' or 'assistant'
                 content TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                timestamp INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)), -- Unix epoch seconds
                 openai_message_id TEXT,
                 metadata TEXT, -- JSON for additional data
+                embedding BLOB, -- float32 query embedding for the semantic cache
                 FOREIGN KEY (session_id) REFERENCES chat_sessions (session_id)
             )
         ''')
         
+        # Add columns introduced after a database was first created
+        cursor.execute('PRAGMA table_info(messages)')
+        if 'embedding' not in {row[1] for row in cursor}:
+            cursor.execute('ALTER TABLE messages ADD COLUMN embedding BLOB')
+        
+        cursor.execute('PRAGMA table_info(chat_sessions)')
+        if 'message_count' not in {row[1] for row in cursor}:
+            cursor.execute('ALTER TABLE chat_sessions ADD COLUMN message_count INTEGER DEFAULT 0')
+            cursor.execute('''
+                UPDATE chat_sessions 
+                SET message_count = (SELECT COUNT(*) FROM messages WHERE session_id = chat_sessions.session_id)
+            ''')
+        
+        # Tables created before timestamps were epoch integers still hold ISO TEXT
+        for table, columns in _EPOCH_COLUMNS.items():
+            self._migrate_epoch_columns(cursor, table, columns)
+        
         # Users table - basic user management
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -89,29 +443,113 @@ class ChatDatabase:
             )
         ''')
         
+        # Assistants table - tracks OpenAI assistants so restarts can reuse them
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS assistants (
+                assistant_id TEXT PRIMARY KEY,
+                vector_store_id TEXT NOT NULL,
+                model TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status TEXT DEFAULT 'active'
+            )
+        ''')
+        
+        # Counters table - live row counts for get_stats, maintained by the write methods
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        # Hourly message buckets (hours since the epoch) for the rolling 24h message count
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS messages_hourly (
+                hour INTEGER PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        # Seed the counters from existing rows the first time they are created
+        cursor.execute('SELECT COUNT(*) FROM counters')
+        if cursor.fetchone()[0] == 0:
+            cursor.execute('''
+                INSERT INTO counters (name, value)
+                SELECT 'documents', COUNT(*) FROM documents WHERE status = 'active'
+                UNION ALL SELECT 'sessions', COUNT(*) FROM chat_sessions WHERE status = 'active'
+                UNION ALL SELECT 'messages', COUNT(*) FROM messages
+                UNION ALL SELECT 'users', COUNT(*) FROM users
+            ''')
+            cursor.execute('''
+                INSERT OR REPLACE INTO messages_hourly (hour, count)
+                SELECT timestamp / 3600, COUNT(*)
+                FROM messages
+                WHERE timestamp >= CAST(strftime('%s', 'now') AS INTEGER) - 86400
+                GROUP BY 1
+            ''')
+        
+        # Answers from before the latest upload are stale; later deletes move this forward too
+        cursor.execute('''
+            INSERT OR IGNORE INTO counters (name, value)
+            SELECT 'cache_watermark', COALESCE(MAX(id), 0) FROM messages 
+            WHERE timestamp < (SELECT MAX(upload_date) FROM documents)
+        ''')
+        
         # Create indexes for better performance
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages(session_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_status ON documents(status)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON chat_sessions(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON chat_sessions(last_activity)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_session_time ON messages(session_id, timestamp)')
+        # Partial covering index: active document listings and counts never touch the table
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_documents_active_recent 
+            ON documents(upload_date DESC, filename, openai_file_id, file_size, uploaded_by, status) 
+            WHERE status = 'active'
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user_active ON chat_sessions(user_id, status, last_activity DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_status_active ON chat_sessions(status, last_activity DESC)')
         
-        conn.commit()
-        conn.close()
-        logger.info(f"Database initialized for organization: {self.organization_name}")
+        # Superseded by the compound indexes above
+        cursor.execute('DROP INDEX IF EXISTS idx_messages_session_id')
+        cursor.execute('DROP INDEX IF EXISTS idx_documents_status')
+        cursor.execute('DROP INDEX IF EXISTS idx_sessions_user_id')
+        cursor.execute('DROP INDEX IF EXISTS idx_sessions_last_activity')
+    
+    def _migrate_epoch_columns(self, cursor: sqlite3.Cursor, table: str, columns: Tuple[str, ...]):
+        """Rebuild a table whose timestamp columns are ISO TEXT so they hold epoch seconds."""
+        cursor.execute(f'PRAGMA table_info({table})')
+        table_columns = [(row[1], row[2]) for row in cursor]
+        if all(col_type == 'INTEGER' for name, col_type in table_columns if name in columns):
+            return
+        
+        # SQLite cannot change a column's type or default in place: copy into a new table
+        # with the same definition, then swap it in (indexes are recreated by _create_schema)
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        create_sql = cursor.fetchone()[0].replace(table, f'{table}_epoch', 1)
+        for column in columns:
+            create_sql = create_sql.replace(
+                f'{column} TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
+                f"{column} INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))"
+            )
+        
+        select_list = ', '.join(
+            f"CAST(strftime('%s', {name}) AS INTEGER)" if name in columns else name
+            for name, _ in table_columns
+        )
+        cursor.execute(create_sql)
+        cursor.execute(f'INSERT INTO {table}_epoch SELECT {select_list} FROM {table}')
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_epoch RENAME TO {table}')
+        logger.info(f"Converted {table} timestamps to epoch seconds")
     
     # === VECTOR STORE METHODS ===
     
     def create_vector_store(self, vector_store_id: str, name: str) -> bool:
         """Record a new vector store in the database."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO vector_stores (vector_store_id, name)
-                VALUES (?, ?)
-            ''', (vector_store_id, name))
-            conn.commit()
-            conn.close()
+            with self._write() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR REPLACE INTO vector_stores (vector_store_id, name)
+                    VALUES (?, ?)
+                ''', (vector_store_id, name))
             return True
         except Exception as e:
             logger.error(f"Error creating vector store record: {e}")
@@ -119,16 +557,39 @@ class ChatDatabase:
     
     def get_vector_store(self) -> Optional[str]:
         """Get the active vector store ID for this organization."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT vector_store_id FROM vector_stores 
-            WHERE status = 'active' 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        ''')
-        result = cursor.fetchone()
-        conn.close()
+        with self._read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_ACTIVE_VECTOR_STORE)
+            result = cursor.fetchone()
+        return result[0] if result else None
+    
+    # === ASSISTANT METHODS ===
+    
+    def set_assistant(self, assistant_id: str, vector_store_id: str, model: str) -> bool:
+        """Record the assistant serving a vector store, retiring any previous one."""
+        try:
+            with self._write() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE assistants 
+                    SET status = 'inactive' 
+                    WHERE vector_store_id = ? AND model = ? AND status = 'active'
+                ''', (vector_store_id, model))
+                cursor.execute('''
+                    INSERT OR REPLACE INTO assistants (assistant_id, vector_store_id, model)
+                    VALUES (?, ?, ?)
+                ''', (assistant_id, vector_store_id, model))
+            return True
+        except Exception as e:
+            logger.error(f"Error saving assistant record: {e}")
+            return False
+    
+    def get_assistant(self, vector_store_id: str, model: str) -> Optional[str]:
+        """Get the active assistant ID for a vector store and model."""
+        with self._read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_ACTIVE_ASSISTANT, (vector_store_id, model))
+            result = cursor.fetchone()
         return result[0] if result else None
     
     # === DOCUMENT METHODS ===
@@ -137,80 +598,129 @@ class ChatDatabase:
                     file_size: int, uploaded_by: str = None) -> bool:
         """Add a document record to the database."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO documents (id, filename, openai_file_id, vector_store_id, 
-                                     file_size, uploaded_by)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (openai_file_id, filename, openai_file_id, vector_store_id, file_size, uploaded_by))
-            
-            # Update document count in vector store
-            cursor.execute('''
-                UPDATE vector_stores 
-                SET document_count = document_count + 1 
-                WHERE vector_store_id = ?
-            ''', (vector_store_id,))
+            with self._write() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO documents (id, filename, openai_file_id, vector_store_id, 
+                                         file_size, uploaded_by)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (openai_file_id, filename, openai_file_id, vector_store_id, file_size, uploaded_by))
+                
+                # Update document count in vector store
+                cursor.execute('''
+                    UPDATE vector_stores 
+                    SET document_count = document_count + 1 
+                    WHERE vector_store_id = ?
+                ''', (vector_store_id,))
+                cursor.execute(_SQL_BUMP_COUNTER, (1, 'documents'))
+                cursor.execute(_SQL_BUMP_CACHE_WATERMARK)
             
-            conn.commit()
-            conn.close()
             logger.info(f"Added document: {filename} ({openai_file_id})")
             return True
         except Exception as e:
             logger.error(f"Error adding document: {e}")
             return False
     
+    def add_documents_bulk(self, rows: List[Dict]) -> bool:
+        """Add several document records in a single transaction."""
+        if not rows:
+            return True
+        try:
+            with self._write() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO documents (id, filename, openai_file_id, vector_store_id, 
+                                         file_size, uploaded_by)
+                    VALUES (:openai_file_id, :filename, :openai_file_id, :vector_store_id, 
+                            :file_size, :uploaded_by)
+                ''', [{'uploaded_by': None, **row} for row in rows])
+                
+                # Update document count in each affected vector store
+                counts = {}
+                for row in rows:
+                    counts[row['vector_store_id']] = counts.get(row['vector_store_id'], 0) + 1
+                cursor.executemany('''
+                    UPDATE vector_stores 
+                    SET document_count = document_count + ? 
+                    WHERE vector_store_id = ?
+                ''', [(count, vector_store_id) for vector_store_id, count in counts.items()])
+                cursor.execute(_SQL_BUMP_COUNTER, (len(rows), 'documents'))
+                cursor.execute(_SQL_BUMP_CACHE_WATERMARK)
+            
+            logger.info(f"Added {len(rows)} documents")
+            return True
+        except Exception as e:
+            logger.error(f"Error adding documents: {e}")
+            return False
+    
     def list_documents(self) -> List[Dict]:
         """List all active documents for this organization."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT filename, openai_file_id, upload_date, file_size, uploaded_by
-            FROM documents 
-            WHERE status = 'active'
-            ORDER BY upload_date DESC
-        ''')
+        with self._read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT filename, openai_file_id AS id, datetime(upload_date, 'unixepoch') AS upload_date, 
+                       file_size AS size, COALESCE(NULLIF(uploaded_by, ''), 'Unknown') AS uploaded_by
+                FROM documents 
+                WHERE status = 'active'
+                ORDER BY documents.upload_date DESC
+            ''')
+            
+            docs = [dict(row) for row in cursor]
         
-        docs = []
-        for row in cursor.fetchall():
-            docs.append({
-                'filename': row[0],
-                'id': row[1],
-                'upload_date': row[2],
-                'size': row[3],
-                'uploaded_by': row[4] or 'Unknown'
-            })
-        
-        conn.close()
         return docs
     
-    def delete_document(self, file_id: str) -> bool:
-        """Mark a document as deleted."""
-        try:
-            conn = sqlite3.connect(self.db_path)
+    def list_recent_documents(self, limit: int = 3) -> List[Dict]:
+        """List the most recently uploaded active documents."""
+        with self._read() as conn:
             cursor = conn.cursor()
+            cursor.execute(_SQL_RECENT_DOCUMENTS, (limit,))
             
-            # Get vector store ID before deletion
-            cursor.execute('SELECT vector_store_id FROM documents WHERE openai_file_id = ?', (file_id,))
-            result = cursor.fetchone()
-            
-            # Mark as deleted
+            docs = [dict(row) for row in cursor]
+        
+        return docs
+    
+    def get_document(self, file_id: str) -> Optional[Dict]:
+        """Get a single active document by its OpenAI file ID."""
+        with self._read() as conn:
+            cursor = conn.cursor()
+            # id mirrors openai_file_id, so this is a primary key lookup
             cursor.execute('''
-                UPDATE documents 
-                SET status = 'deleted' 
-                WHERE openai_file_id = ?
+                SELECT filename, openai_file_id AS id, datetime(upload_date, 'unixepoch') AS upload_date, 
+                       file_size AS size, COALESCE(NULLIF(uploaded_by, ''), 'Unknown') AS uploaded_by
+                FROM documents 
+                WHERE id = ? AND status = 'active'
             ''', (file_id,))
             
-            # Update document count in vector store
-            if result:
+            row = cursor.fetchone()
+        
+        return dict(row) if row else None
+    
+    def delete_document(self, file_id: str) -> bool:
+        """Mark a document as deleted."""
+        try:
+            with self._write() as conn:
+                cursor = conn.cursor()
+                
+                # Mark as deleted, getting back the vector store of each row that was active
                 cursor.execute('''
-                    UPDATE vector_stores 
-                    SET document_count = document_count - 1 
-                    WHERE vector_store_id = ?
-                ''', (result[0],))
+                    UPDATE documents 
+                    SET status = 'deleted' 
+                    WHERE openai_file_id = ? AND status = 'active'
+                    RETURNING vector_store_id
+                ''', (file_id,))
+                deleted = [row[0] for row in cursor]
+                
+                if deleted:
+                    cursor.execute(_SQL_BUMP_COUNTER, (-len(deleted), 'documents'))
+                    cursor.execute(_SQL_BUMP_CACHE_WATERMARK)
+                    
+                    # Update document count in vector store
+                    cursor.executemany('''
+                        UPDATE vector_stores 
+                        SET document_count = document_count - 1 
+                        WHERE vector_store_id = ?
+                    ''', [(vector_store_id,) for vector_store_id in deleted])
             
-            conn.commit()
-            conn.close()
             logger.info(f"Deleted document: {file_id}")
             return True
         except Exception as e:
@@ -219,11 +729,10 @@ class ChatDatabase:
     
     def get_document_count(self) -> int:
         """Get total number of active documents."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM documents WHERE status = "active"')
-        count = cursor.fetchone()[0]
-        conn.close()
+        with self._read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_DOCUMENT_COUNT)
+            count = cursor.fetchone()[0]
         return count
     
     # === CHAT SESSION METHODS ===
@@ -233,15 +742,14 @@ class ChatDatabase:
                            vector_store_id: str = None, title: str = "New Chat") -> str:
         """Create a new chat session."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO chat_sessions 
-                (session_id, user_id, thread_id, assistant_id, vector_store_id, title)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (session_id, user_id, thread_id, assistant_id, vector_store_id, title))
-            conn.commit()
-            conn.close()
+            with self._write() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_SQL_SESSION_EXISTS, (session_id,))
+                is_new = cursor.fetchone() is None
+                # Upsert rather than REPLACE: keeps created_at, message_count and status on an existing session
+                cursor.execute(_SQL_UPSERT_SESSION, (session_id, user_id, thread_id, assistant_id, vector_store_id, title))
+                if is_new:
+                    cursor.execute(_SQL_BUMP_COUNTER, (1, 'sessions'))
             logger.info(f"Created chat session: {session_id}")
             return session_id
         except Exception as e:
@@ -250,163 +758,162 @@ class ChatDatabase:
     
     def get_chat_session(self, session_id: str) -> Optional[Dict]:
         """Get chat session details."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT session_id, user_id, thread_id, assistant_id, vector_store_id, 
-                   created_at, last_activity, title, status
-            FROM chat_sessions 
-            WHERE session_id = ?
-        ''', (session_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return {
-                'session_id': row[0],
-                'user_id': row[1],
-                'thread_id': row[2],
-                'assistant_id': row[3],
-                'vector_store_id': row[4],
-                'created_at': row[5],
-                'last_activity': row[6],
-                'title': row[7],
-                'status': row[8]
-            }
-        return None
+        with self._read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_GET_SESSION, (session_id,))
+            
+            row = cursor.fetchone()
+        
+        return dict(row) if row else None
     
     def list_chat_sessions(self, user_id: str = None, limit: int = 50) -> List[Dict]:
         """List chat sessions, optionally filtered by user."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        if user_id:
-            cursor.execute('''
-                SELECT session_id, title, created_at, last_activity, 
-                       (SELECT COUNT(*) FROM messages WHERE session_id = cs.session_id) as message_count
-                FROM chat_sessions cs
-                WHERE user_id = ? AND status = 'active'
-                ORDER BY last_activity DESC
-                LIMIT ?
-            ''', (user_id, limit))
-        else:
-            cursor.execute('''
-                SELECT session_id, title, created_at, last_activity,
-                       (SELECT COUNT(*) FROM messages WHERE session_id = cs.session_id) as message_count
-                FROM chat_sessions cs
-                WHERE status = 'active'
-                ORDER BY last_activity DESC
-                LIMIT ?
-            ''', (limit,))
+        with self._read() as conn:
+            cursor = conn.cursor()
+            
+            if user_id:
+                cursor.execute(_SQL_USER_SESSIONS, (user_id, limit))
+            else:
+                cursor.execute(_SQL_ACTIVE_SESSIONS, (limit,))
+            
+            sessions = [dict(row) for row in cursor]
         
-        sessions = []
-        for row in cursor.fetchall():
-            sessions.append({
-                'session_id': row[0],
-                'title': row[1],
-                'created_at': row[2],
-                'last_activity': row[3],
-                'message_count': row[4]
-            })
-        
-        conn.close()
         return sessions
     
     def update_session_activity(self, session_id: str):
         """Update the last activity timestamp for a session."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE chat_sessions 
-                SET last_activity = CURRENT_TIMESTAMP 
-                WHERE session_id = ?
-            ''', (session_id,))
-            conn.commit()
-            conn.close()
+            with self._write() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_SQL_UPDATE_ACTIVITY, (session_id,))
         except Exception as e:
             logger.error(f"Error updating session activity: {e}")
     
     def update_chat_title(self, session_id: str, title: str):
         """Update the title of a chat session."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE chat_sessions 
-                SET title = ? 
-                WHERE session_id = ?
-            ''', (title, session_id))
-            conn.commit()
-            conn.close()
+            with self._write() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_SQL_UPDATE_TITLE, (title, session_id))
             logger.info(f"Updated chat title: {session_id} -> {title}")
         except Exception as e:
             logger.error(f"Error updating chat title: {e}")
     
     # === MESSAGE METHODS ===
     
+    def _record_messages(self, cursor: sqlite3.Cursor, session_id: str, count: int):
+        """Update the session and the stats counters for newly saved messages."""
+        # Update session last activity and message count
+        cursor.execute(_SQL_RECORD_MESSAGES, (count, session_id))
+        cursor.execute(_SQL_BUMP_COUNTER, (count, 'messages'))
+        cursor.execute(_SQL_BUMP_MESSAGES_HOURLY, (count,))
+    
     def save_message(self, session_id: str, role: str, content: str, 
-                    openai_message_id: str = None, metadata: Dict = None) -> bool:
+                    openai_message_id: str = None, metadata: Dict = None,
+                    embedding: bytes = None) -> bool:
         """Save a message to the database."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            metadata_json = json.dumps(metadata) if metadata else None
-            
-            cursor.execute('''
-                INSERT INTO messages (session_id, role, content, openai_message_id, metadata)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (session_id, role, content, openai_message_id, metadata_json))
-            
-            # Update session last activity
-            cursor.execute('''
-                UPDATE chat_sessions 
-                SET last_activity = CURRENT_TIMESTAMP 
-                WHERE session_id = ?
-            ''', (session_id,))
+            with self._write() as conn:
+                cursor = conn.cursor()
+                
+                metadata_json = _dump_json(metadata)
+                
+                cursor.execute(_SQL_SAVE_MESSAGE, (session_id, role, content, openai_message_id, metadata_json, embedding))
+                
+                self._record_messages(cursor, session_id, 1)
             
-            conn.commit()
-            conn.close()
+            self._invalidate_history(session_id)
             return True
         except Exception as e:
             logger.error(f"Error saving message: {e}")
             return False
     
+    def save_messages_bulk(self, session_id: str, rows: List[Dict]) -> bool:
+        """Save several messages for a session in a single transaction."""
+        if not rows:
+            return True
+        try:
+            with self._write() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(_SQL_SAVE_MESSAGE, [
+                    (session_id, row['role'], row['content'], row.get('openai_message_id'),
+                     _dump_json(row.get('metadata')), row.get('embedding'))
+                    for row in rows
+                ])
+                
+                self._record_messages(cursor, session_id, len(rows))
+            
+            self._invalidate_history(session_id)
+            return True
+        except Exception as e:
+            logger.error(f"Error saving messages: {e}")
+            return False
+    
     def get_chat_history(self, session_id: str, limit: int = 50) -> List[Dict]:
-        """Get chat history for a session."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT role, content, timestamp, openai_message_id, metadata
-            FROM messages 
-            WHERE session_id = ?
-            ORDER BY timestamp ASC
-            LIMIT ?
-        ''', (session_id, limit))
-        
-        messages = []
-        for row in cursor.fetchall():
-            metadata = json.loads(row[4]) if row[4] else {}
-            messages.append({
-                'role': row[0],
-                'content': row[1],
-                'timestamp': row[2],
-                'openai_message_id': row[3],
-                'metadata': metadata
-            })
-        
-        conn.close()
+        """Get chat history for a session, served from cache until the session changes."""
+        key = (session_id, limit)
+        with self._cache_lock:
+            messages = self._history_cache.get(key)
+            generation = self._cache_generation
+        if messages is not None:
+            # Callers get their own copy, so mutating it cannot corrupt the cache
+            return copy.deepcopy(messages)
+        
+        with self._read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_CHAT_HISTORY, (session_id, limit))
+            
+            messages = [dict(row) for row in cursor]
+        
+        with self._cache_lock:
+            # A write committed during the read may already have invalidated this key
+            if generation == self._cache_generation:
+                self._history_cache[key] = copy.deepcopy(messages)
         return messages
     
+    def get_recent_exchanges(self, limit: int = 1000) -> List[Dict]:
+        """Get recent embedded user questions paired with the answer that followed them.
+        
+        Only exchanges newer than the latest document upload or delete are returned,
+        since older answers may not reflect the current knowledge base.
+        """
+        with self._read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT q.content AS query, a.content AS response, q.embedding, cs.vector_store_id
+                FROM messages q
+                JOIN messages a ON a.id = (
+                    SELECT MIN(id) FROM messages 
+                    WHERE session_id = q.session_id AND id > q.id AND role = 'assistant'
+                )
+                JOIN chat_sessions cs ON cs.session_id = q.session_id
+                WHERE q.role = 'user' AND q.embedding IS NOT NULL
+                  -- Only a session's opening question stands on its own without thread context
+                  AND NOT EXISTS (
+                      SELECT 1 FROM messages p 
+                      WHERE p.session_id = q.session_id AND p.role = 'user' AND p.id < q.id
+                  )
+                  -- A later user turn before the answer means q's own run never completed
+                  AND NOT EXISTS (
+                      SELECT 1 FROM messages m 
+                      WHERE m.session_id = q.session_id AND m.role = 'user' 
+                        AND m.id > q.id AND m.id < a.id
+                  )
+                  AND q.id > COALESCE((SELECT value FROM counters WHERE name = 'cache_watermark'), 0)
+                ORDER BY q.id DESC
+                LIMIT ?
+            ''', (limit,))
+            
+            exchanges = [dict(row) for row in cursor]
+        
+        return exchanges
+    
     def get_message_count(self, session_id: str) -> int:
         """Get total message count for a session."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM messages WHERE session_id = ?', (session_id,))
-        count = cursor.fetchone()[0]
-        conn.close()
+        with self._read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_MESSAGE_COUNT, (session_id,))
+            count = cursor.fetchone()[0]
         return count
     
     # === USER METHODS ===
@@ -415,18 +922,18 @@ class ChatDatabase:
                              name: str = None, preferences: Dict = None) -> bool:
         """Create or update a user record."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            preferences_json = json.dumps(preferences) if preferences else None
+            with self._write() as conn:
+                cursor = conn.cursor()
+                
+                preferences_json = _dump_json(preferences)
+                
+                cursor.execute(_SQL_USER_EXISTS, (user_id,))
+                is_new = cursor.fetchone() is None
+                # Upsert rather than REPLACE: keeps created_at on an existing user
+                cursor.execute(_SQL_UPSERT_USER, (user_id, email, name, preferences_json))
+                if is_new:
+                    cursor.execute(_SQL_BUMP_COUNTER, (1, 'users'))
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO users (user_id, email, name, preferences, last_login)
-                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (user_id, email, name, preferences_json))
-            
-            conn.commit()
-            conn.close()
             return True
         except Exception as e:
             logger.error(f"Error creating/updating user: {e}")
@@ -434,63 +941,37 @@ class ChatDatabase:
     
     def get_user(self, user_id: str) -> Optional[Dict]:
         """Get user details."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT user_id, email, name, created_at, last_login, preferences
-            FROM users 
-            WHERE user_id = ?
-        ''', (user_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            preferences = json.loads(row[5]) if row[5] else {}
-            return {
-                'user_id': row[0],
-                'email': row[1],
-                'name': row[2],
-                'created_at': row[3],
-                'last_login': row[4],
-                'preferences': preferences
-            }
-        return None
+        with self._read() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, email, name, created_at, last_login,
+                       COALESCE(preferences, '{}') AS "preferences [json]"
+                FROM users 
+                WHERE user_id = ?
+            ''', (user_id,))
+            
+            row = cursor.fetchone()
+        
+        return dict(row) if row else None
     
     # === ANALYTICS/STATS METHODS ===
     
     def get_stats(self) -> Dict:
-        """Get database statistics."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get counts
-        cursor.execute('SELECT COUNT(*) FROM documents WHERE status = "active"')
-        document_count = cursor.fetchone()[0]
+        """Get database statistics, reused for up to STATS_CACHE_TTL seconds."""
+        with self._cache_lock:
+            stats = self._stats_cache.get('stats')
+            generation = self._cache_generation
+        if stats is not None:
+            return dict(stats)
         
-        cursor.execute('SELECT COUNT(*) FROM chat_sessions WHERE status = "active"')
-        session_count = cursor.fetchone()[0]
+        # Counters maintained by the write methods plus the last 24 hourly buckets, in one statement
+        with self._read() as conn:
+            row = conn.execute(_SQL_STATS).fetchone()
         
-        cursor.execute('SELECT COUNT(*) FROM messages')
-        message_count = cursor.fetchone()[0]
+        stats = {key: row[key] or 0 for key in row.keys()}
+        stats['organization'] = self.organization_name
         
-        cursor.execute('SELECT COUNT(*) FROM users')
-        user_count = cursor.fetchone()[0]
-        
-        # Get recent activity
-        cursor.execute('''
-            SELECT COUNT(*) FROM messages 
-            WHERE timestamp >= datetime('now', '-24 hours')
-        ''')
-        messages_24h = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        return {
-            'documents': document_count,
-            'sessions': session_count,
-            'messages': message_count,
-            'users': user_count,
-            'messages_24h': messages_24h,
-            'organization': self.organization_name
-        }
\ No newline at end of file
+        with self._cache_lock:
+            if generation == self._cache_generation:
+                self._stats_cache['stats'] = dict(stats)
+        return stats
\ No newline at end of file
@@ -0,0 +1,183 @@
+import os
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def encode_embedding(embedding) -> bytes:
+    """Pack an embedding as float32 bytes for storage."""
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+def decode_embedding(blob: bytes) -> np.ndarray:
+    """Unpack an embedding stored by encode_embedding."""
+    return np.frombuffer(blob, dtype=np.float32)
+
+def _pack_strings(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate strings as UTF-8 bytes, returned with each string's end offset.
+
+    A str array would pad every entry to the longest one, at 4 bytes per character.
+    """
+    encoded = [text.encode("utf-8") for text in strings]
+    ends = np.cumsum([len(data) for data in encoded], dtype=np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), ends
+
+def _unpack_strings(blob: np.ndarray, ends: np.ndarray) -> List[str]:
+    """Split bytes packed by _pack_strings back into strings."""
+    data = blob.tobytes()
+    starts = [0] + ends[:-1].tolist()
+    return [data[start:end].decode("utf-8") for start, end in zip(starts, ends.tolist())]
+
+class SemanticCache:
+    """In-memory nearest-neighbour cache of assistant answers keyed by query embedding."""
+
+    def __init__(self, path: Optional[str] = None, threshold: float = 0.92,
+                 max_entries: int = 1000, save_every: int = 20):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.save_every = save_every
+
+        # Normalized embeddings, one row per entry, so inner product == cosine similarity
+        self._embeddings: Optional[np.ndarray] = None
+        self._namespaces: List[str] = []
+        self._queries: List[str] = []
+        self._responses: List[str] = []
+        self._unsaved = 0
+        # Bumped by every clear(), so slow writers can tell the entries they read are stale
+        self.generation = 0
+
+        if self.path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        """Convert an embedding to a unit-length float32 vector."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, namespace: str, embedding) -> Optional[str]:
+        """Return the cached response closest to the embedding, if similar enough."""
+        if self._embeddings is None or not len(self):
+            return None
+
+        scores = self._embeddings @ self._normalize(embedding)
+        # Only entries answered against the same knowledge base are candidates
+        mask = np.fromiter((ns == namespace for ns in self._namespaces), dtype=bool, count=len(self))
+        scores = np.where(mask, scores, -1.0)
+
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            # Lazy %-formatting: the repr is only built when debug logging is on
+            logger.debug("Semantic cache hit (%.3f): %r", scores[best], self._queries[best])
+            return self._responses[best]
+        return None
+
+    def add(self, namespace: str, query: str, embedding, response: str):
+        """Insert a query/response pair, evicting the oldest entries when full."""
+        vector = self._normalize(embedding)[np.newaxis, :]
+
+        if self._embeddings is None or self._embeddings.shape[1] != vector.shape[1]:
+            # First entry, or the embedding model changed: start over
+            self.clear()
+            self._embeddings = vector
+        else:
+            self._embeddings = np.vstack([self._embeddings, vector])
+
+        self._namespaces.append(namespace)
+        self._queries.append(query)
+        self._responses.append(response)
+
+        overflow = len(self) - self.max_entries
+        if overflow > 0:
+            self._embeddings = self._embeddings[overflow:]
+            del self._namespaces[:overflow]
+            del self._queries[:overflow]
+            del self._responses[:overflow]
+
+        self._unsaved += 1
+        if self.path and self._unsaved >= self.save_every:
+            self.save()
+
+    def extend(self, entries):
+        """Bulk-insert (namespace, query, embedding, response) tuples, oldest first."""
+        entries = list(entries)[-self.max_entries:]
+        if not entries:
+            return
+
+        vectors = np.vstack([self._normalize(embedding) for _, _, embedding, _ in entries])
+        if self._embeddings is None or self._embeddings.shape[1] != vectors.shape[1]:
+            self.clear()
+            self._embeddings = vectors
+        else:
+            self._embeddings = np.vstack([self._embeddings, vectors])
+
+        for namespace, query, _, response in entries:
+            self._namespaces.append(namespace)
+            self._queries.append(query)
+            self._responses.append(response)
+
+        overflow = len(self) - self.max_entries
+        if overflow > 0:
+            self._embeddings = self._embeddings[overflow:]
+            del self._namespaces[:overflow]
+            del self._queries[:overflow]
+            del self._responses[:overflow]
+
+    def clear(self):
+        """Drop every cached entry, including the saved copy."""
+        self._embeddings = None
+        self._namespaces = []
+        self._queries = []
+        self._responses = []
+        self._unsaved = 0
+        self.generation += 1
+        if self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                logger.error(f"Error removing semantic cache file: {e}")
+
+    def save(self):
+        """Persist the cache to disk for a warm start."""
+        if not self.path:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp.npz"
+            arrays = {}
+            for field in ("namespaces", "queries", "responses"):
+                arrays[f"{field}_blob"], arrays[f"{field}_ends"] = _pack_strings(getattr(self, f"_{field}"))
+            np.savez(
+                tmp_path,
+                embeddings=self._embeddings if self._embeddings is not None else np.empty((0, 0), dtype=np.float32),
+                **arrays
+            )
+            os.replace(tmp_path, self.path)
+            self._unsaved = 0
+        except Exception as e:
+            logger.error(f"Error saving semantic cache: {e}")
+
+    def load(self):
+        """Load a previously saved cache from disk, if present."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                embeddings = data["embeddings"]
+                self._embeddings = embeddings if embeddings.size else None
+                for field in ("namespaces", "queries", "responses"):
+                    if f"{field}_ends" in data.files:
+                        values = _unpack_strings(data[f"{field}_blob"], data[f"{field}_ends"])
+                    else:
+                        # Files saved before strings were packed hold fixed-width str arrays
+                        values = data[field].tolist()
+                    setattr(self, f"_{field}", values)
+            logger.info(f"Loaded {len(self)} semantic cache entries from {self.path}")
+        except Exception as e:
+            logger.error(f"Error loading semantic cache: {e}")
+            self.clear()
@@ -7,6 +7,7 @@ Tests core functionality of the RAG system locally
 import os
 import sys
 import sqlite3
+import tempfile
 from pathlib import Path
 
 def test_environment():
@@ -65,8 +66,8 @@ def test_database():
         sys.path.append(os.path.dirname(__file__))
         from database import ChatDatabase
         
-        # Create test database
-        db = ChatDatabase("test-local")
+        # Create test database in memory; nothing here needs to reach the disk
+        db = ChatDatabase("test-local", db_path=":memory:")
         
         # Test basic operations
         db.create_chat_session("test-session", "test-user")
@@ -89,7 +90,8 @@ def test_config():
     print("⚙️ Testing Configuration Module...")
     
     try:
-        from config import config
+        from config import get_config
+        config = get_config()
         
         # Test basic config properties
         assert config.organization_name
@@ -109,7 +111,8 @@ def test_openai_connection():
     
     try:
         from openai import OpenAI
-        from config import config
+        from config import get_config
+        config = get_config()
         
         if not config.openai_api_key or config.openai_api_key == "your-openai-api-key-here":
             print("❌ OpenAI API key not set in .env file")
@@ -141,10 +144,9 @@ def test_data_directory():
         # Create directory if it doesn't exist
         data_dir.mkdir(exist_ok=True)
         
-        # Test write permissions
-        test_file = data_dir / "test.txt"
-        test_file.write_text("test")
-        test_file.unlink()  # Delete test file
+        # Test write permissions (the temporary file is removed on close)
+        with tempfile.TemporaryFile(dir=data_dir) as test_file:
+            test_file.write(b"test")
         
         print("✅ Data directory is accessible!")
         return True
@@ -199,8 +201,8 @@ if __name__ == "__main__":
     # Load environment variables if .env file exists
     env_file = Path(".env")
     if env_file.exists():
-        from dotenv import load_dotenv
-        load_dotenv()
+        from config import load_environment
+        load_environment()
     
     success = run_all_tests()
     sys.exit(0 if success else 1)
\ No newline at end of file